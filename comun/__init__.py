@@ -0,0 +1 @@
+"""Código compartido entre unidades (solo biblioteca estándar)."""
@@ -0,0 +1,47 @@
+"""
+Lectura incremental de documentos en JSON, compartida por las unidades
+(w1 la usa para la carga masiva y w2 como fuente del stream).
+"""
+
+import json
+
+
+def iter_json_records(path, chunk_size=1 << 20):
+    """
+    Registros de un archivo JSONL (uno por línea) o de un arreglo JSON como
+    el document_data_v2.json de w3, leídos por bloques sin cargar el archivo.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buffer = f.read(chunk_size)
+        start = len(buffer) - len(buffer.lstrip())
+        if not buffer[start:start + 1] == "[":
+            f.seek(0)
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+            return
+
+        pos = start + 1
+        while True:
+            # Saltar separadores; si se acaba el bloque, leer el siguiente
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer):
+                buffer, pos = f.read(chunk_size), 0
+                if not buffer:
+                    return
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Registro cortado al final del bloque
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            yield record
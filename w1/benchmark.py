@@ -0,0 +1,156 @@
+"""
+Unidad 1: Benchmark reproducible de búsqueda (índice invertido vs lineal).
+
+Construye corpus sintéticos con semilla fija, genera consultas con
+distribución de Zipf sobre el vocabulario y reporta latencias p50/p95/p99,
+consultas por segundo, tiempo de construcción y memoria por documento.
+El resultado se emite como JSON para comparar corridas.
+
+    python3 w1/benchmark.py --sizes 10000,100000 --output bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from bisect import bisect_left
+
+from main import DocumentSystem
+
+
+def _rss_bytes():
+    """Memoria residente actual (Linux: /proc; otros: pico de getrusage)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(sorted_values, p):
+    """Percentil por rango más cercano sobre valores ya ordenados."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def zipf_queries(system, num_queries, seed, exponent=1.1, two_term_ratio=0.3):
+    """
+    Consultas de 1 o 2 términos; el término de rango r (por frecuencia de
+    documento) aparece con probabilidad proporcional a 1 / r^exponent.
+    """
+    index = system.inverted_index
+    terms = sorted(index.vocabulary.terms, key=lambda t: (-index.doc_freq(t), t))
+    cumulative = []
+    total = 0.0
+    for rank in range(1, len(terms) + 1):
+        total += 1.0 / rank ** exponent
+        cumulative.append(total)
+
+    rng = random.Random(seed)
+
+    def draw():
+        return terms[bisect_left(cumulative, rng.random() * total)]
+
+    queries = []
+    for _ in range(num_queries):
+        if rng.random() < two_term_ratio:
+            queries.append(f"{draw()} {draw()}")
+        else:
+            queries.append(draw())
+    return queries
+
+
+def measure(search, queries, warmup=5):
+    for query in queries[:warmup]:
+        search(query)
+    latencies = []
+    start = time.perf_counter()
+    for query in queries:
+        t0 = time.perf_counter()
+        search(query)
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "queries": len(queries),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 4),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 4),
+        "qps": round(len(queries) / elapsed, 2) if elapsed else None,
+    }
+
+
+def run_size(num_docs, seed, num_queries, linear_queries, linear_max_docs, top_k, workers):
+    random.seed(seed)
+    system = DocumentSystem()
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    system.add_documents(DocumentSystem._dummy_documents(num_docs), workers=workers, progress_every=0)
+    build_seconds = time.perf_counter() - start
+    rss_after = _rss_bytes()
+
+    queries = zipf_queries(system, num_queries, seed)
+    result = {
+        "num_docs": num_docs,
+        "vocabulary": len(system.inverted_index.vocabulary.terms),
+        "build_seconds": round(build_seconds, 3),
+        "build_docs_per_second": round(num_docs / build_seconds) if build_seconds else None,
+        "memory_bytes_per_doc": round((rss_after - rss_before) / num_docs, 1),
+        "postings_memory": system.inverted_index.memory_stats(),
+        "index": measure(lambda q: system.search_by_keyword(q, top_k=top_k, use_cache=False), queries),
+    }
+    if num_docs <= linear_max_docs:
+        result["linear"] = measure(
+            lambda q: system.search_by_keyword(q, use_inverted_index=False, top_k=top_k),
+            queries[:linear_queries], warmup=1)
+    else:
+        result["linear"] = None
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de búsqueda de la unidad 1")
+    parser.add_argument("--sizes", default="10000,100000",
+                        help="tamaños de corpus separados por coma (ej. 10000,1000000,10000000)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--linear-queries", type=int, default=50)
+    parser.add_argument("--linear-max-docs", type=int, default=100_000,
+                        help="corpus más grandes no miden la búsqueda lineal")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="procesos para tokenizar al construir (0 = sin pool)")
+    parser.add_argument("--output", help="archivo JSON de salida (por defecto stdout)")
+    args = parser.parse_args(argv)
+
+    report = {
+        "seed": args.seed,
+        "top_k": args.top_k,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": [],
+    }
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        print(f"Corpus de {size} documentos...", file=sys.stderr)
+        report["results"].append(run_size(size, args.seed, args.queries, args.linear_queries,
+                                          args.linear_max_docs, args.top_k, args.workers))
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
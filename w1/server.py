@@ -0,0 +1,360 @@
+"""
+Unidad 1: Servidor asyncio (solo biblioteca estándar) sobre DocumentSystem.
+
+Protocolo: una solicitud JSON por línea sobre TCP, una respuesta JSON por
+línea con el mismo "id". Operaciones:
+
+    {"id": 1, "op": "search", "q": "big data", "top_k": 10, "offset": 0, "user": "u1"}
+    {"id": 2, "op": "retrieve", "doc_id": "...", "user": "u1"}
+    {"id": 3, "op": "recommend", "k": 3, "user": "u1"}
+    {"id": 4, "op": "stats"}
+
+Las búsquedas se agrupan en micro-lotes: las consultas idénticas que
+llegan juntas comparten un único resultado y el lote completo se puntúa
+en una sola pasada (DocumentSystem.search_batch) en un executor, de modo
+que el event loop solo hace E/S.
+
+    python3 w1/server.py serve --docs 20000 --port 8765
+    python3 w1/server.py load --port 8765 --connections 64 --requests 20000
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark import percentile
+from main import DocumentSystem, InvertedIndex
+
+
+def _document_json(doc, score=None):
+    return {
+        "_id": doc.doc_id,
+        "title": doc.title,
+        "tags": doc.tags,
+        "accessCount": doc.access_count,
+        "score": round(doc.relevance_score if score is None else score, 4),
+    }
+
+
+class SearchBatcher:
+    """
+    Acumula búsquedas durante `window` segundos (o hasta max_batch consultas
+    distintas) y las resuelve juntas. Las consultas con los mismos términos
+    se fusionan aunque pidan páginas distintas: se calcula la página más
+    profunda una vez y cada solicitud toma su tramo.
+    """
+
+    def __init__(self, system, executor, window=0.002, max_batch=128, max_pending=4096):
+        self.system = system
+        self.executor = executor
+        self.window = window
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._pending = {}  # términos normalizados -> [profundidad, future]
+        self._waiting = 0
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = None
+        self.requests = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.rejected = 0
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def search(self, keyword, top_k=10, offset=0):
+        if self._waiting >= self.max_pending:
+            # Descartar carga en vez de dejar crecer la cola (y la latencia de cola)
+            self.rejected += 1
+            raise OverflowError("servidor saturado")
+        self.requests += 1
+        key = " ".join(InvertedIndex._tokenize(keyword))
+        depth = offset + top_k
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = [depth, asyncio.get_running_loop().create_future()]
+            self._pending[key] = entry
+            self._wakeup.set()
+            if len(self._pending) >= self.max_batch:
+                self._full.set()
+        else:
+            self.coalesced += 1
+            entry[0] = max(entry[0], depth)
+        self._waiting += 1
+        try:
+            results = await asyncio.shield(entry[1])
+        finally:
+            self._waiting -= 1
+        return results[offset:offset + top_k]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+            batch, self._pending = self._pending, {}
+            self._wakeup.clear()
+            self._full.clear()
+            if not batch:
+                continue
+            keys = list(batch)
+            depth = max(entry[0] for entry in batch.values())
+            self.batches += 1
+            # Mientras este lote corre en el executor se va llenando el siguiente
+            try:
+                results = await loop.run_in_executor(self.executor, self.system.search_batch, keys, depth)
+            except Exception as exc:
+                for _, future in batch.values():
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            for key, docs in zip(keys, results):
+                future = batch[key][1]
+                if not future.done():
+                    future.set_result([_document_json(doc, score) for doc, score in docs])
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "avg_batch": round((self.requests - self.coalesced) / self.batches, 2) if self.batches else 0.0,
+            "rejected": self.rejected,
+        }
+
+
+class DocumentServer:
+    def __init__(self, system, host="127.0.0.1", port=8765, workers=2, window=0.002,
+                 max_batch=128, timeout=2.0, max_inflight=64):
+        self.system = system
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        # Solicitudes en curso por conexión; al llegar al tope se deja de leer
+        self.max_inflight = max_inflight
+        self.executor = ThreadPoolExecutor(workers)
+        self.batcher = SearchBatcher(system, self.executor, window, max_batch)
+        self._server = None
+
+    async def start(self):
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        return self._server
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"Escuchando en {self.host}:{self.port}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.batcher.stop()
+        self.executor.shutdown(wait=False)
+
+    async def _dispatch(self, request):
+        op = request.get("op")
+        user = request.get("user")
+        loop = asyncio.get_running_loop()
+        if op == "search":
+            keyword = str(request.get("q", ""))
+            results = await self.batcher.search(keyword, int(request.get("top_k", 10)),
+                                                int(request.get("offset", 0)))
+            self.system.session(user).record_search(keyword.lower())
+            return results
+        if op == "retrieve":
+            doc = await loop.run_in_executor(self.executor, self.system.retrieve_document,
+                                             str(request.get("doc_id", "")), user)
+            return _document_json(doc) if doc else None
+        if op == "recommend":
+            docs = await loop.run_in_executor(self.executor, self.system.randomized_recommendation,
+                                              int(request.get("k", 3)), user)
+            return [_document_json(doc) for doc in docs]
+        if op == "stats":
+            return {"batcher": self.batcher.stats(), "cache": self.system.query_cache.stats(),
+                    "documents": self.system.inverted_index.num_live_docs}
+        raise ValueError(f"operación desconocida: {op}")
+
+    @staticmethod
+    async def _send(writer, write_lock, data):
+        """
+        Escribe una respuesta y espera a que el buffer baje (drain): un
+        cliente que no lee frena a sus propias solicitudes, no a la memoria.
+        """
+        async with write_lock:
+            writer.write(data)
+            await writer.drain()
+
+    async def _respond(self, request, writer, write_lock, slots):
+        try:
+            response = {"id": request.get("id")}
+            try:
+                response["result"] = await asyncio.wait_for(self._dispatch(request), self.timeout)
+                response["ok"] = True
+            except asyncio.TimeoutError:
+                response.update(ok=False, error="timeout")
+            except Exception as exc:
+                response.update(ok=False, error=str(exc))
+            await self._send(writer, write_lock,
+                             json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+        except ConnectionError:
+            pass  # el lazo de lectura ve el cierre y termina
+        finally:
+            slots.release()
+
+    async def _handle(self, reader, writer):
+        # Las solicitudes de una conexión se atienden concurrentemente
+        # (pipelining), a lo sumo max_inflight a la vez
+        tasks = set()
+        write_lock = asyncio.Lock()
+        slots = asyncio.Semaphore(self.max_inflight)
+        try:
+            while True:
+                await slots.acquire()
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    slots.release()
+                    await self._send(writer, write_lock, b'{"ok": false, "error": "JSON inv\\u00e1lido"}\n')
+                    continue
+                task = asyncio.create_task(self._respond(request, writer, write_lock, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+# ---------------------------------------------------------
+# Generador de carga (lazo cerrado: cada conexión espera su respuesta)
+# ---------------------------------------------------------
+def _query_vocabulary(seed):
+    """Mismo vocabulario que los datos de prueba, ordenado de forma estable."""
+    state = random.getstate()
+    random.seed(seed)
+    words = sorted({word for doc in DocumentSystem._dummy_documents(500)
+                    for word in InvertedIndex._tokenize(doc.title)})
+    random.setstate(state)
+    return words
+
+
+async def run_load(host, port, connections, requests, seed=42, exponent=1.1, recommend_ratio=0.05):
+    words = _query_vocabulary(seed)
+    rng = random.Random(seed)
+    rng.shuffle(words)
+    cumulative, total = [], 0.0
+    for rank in range(1, len(words) + 1):
+        total += 1.0 / rank ** exponent
+        cumulative.append(total)
+
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def client(index):
+        nonlocal remaining, errors
+        reader, writer = await asyncio.open_connection(host, port)
+        user = f"user{index}"
+        request_id = 0
+        while remaining > 0:
+            remaining -= 1
+            request_id += 1
+            if rng.random() < recommend_ratio:
+                request = {"id": request_id, "op": "recommend", "k": 3, "user": user}
+            else:
+                query = words[bisect_left(cumulative, rng.random() * total)]
+                request = {"id": request_id, "op": "search", "q": query, "top_k": 10, "user": user}
+            start = time.perf_counter()
+            writer.write(json.dumps(request).encode("utf-8") + b"\n")
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start)
+            if not response.get("ok"):
+                errors += 1
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(connections)))
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'{"id": 0, "op": "stats"}\n')
+    server_stats = json.loads(await reader.readline()).get("result")
+    writer.close()
+
+    latencies.sort()
+    return {
+        "connections": connections,
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "server": server_stats,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor y generador de carga de la unidad 1")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--docs", type=int, default=20000)
+    serve.add_argument("--load-file", help="JSONL / JSON a cargar en vez de datos de prueba")
+    serve.add_argument("--workers", type=int, default=2)
+    serve.add_argument("--window-ms", type=float, default=2.0)
+    serve.add_argument("--seed", type=int, default=42)
+    load = sub.add_parser("load")
+    load.add_argument("--host", default="127.0.0.1")
+    load.add_argument("--port", type=int, default=8765)
+    load.add_argument("--connections", type=int, default=64)
+    load.add_argument("--requests", type=int, default=20000)
+    load.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        random.seed(args.seed)
+        system = DocumentSystem()
+        if args.load_file:
+            system.load_documents(args.load_file)
+        else:
+            system.add_documents(DocumentSystem._dummy_documents(args.docs), progress_every=0)
+        server = DocumentServer(system, args.host, args.port, args.workers, args.window_ms / 1000)
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+    else:
+        report = asyncio.run(run_load(args.host, args.port, args.connections, args.requests, args.seed))
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Pruebas de regresión de la unidad 1 (solo biblioteca estándar).
+
+    cd w1 && python3 -m unittest test_main
+"""
+
+import shutil
+import tempfile
+import unittest
+
+from main import Document, DocumentSystem, ShardedDocumentSystem
+
+
+class ReemplazoAntesDeFlushTest(unittest.TestCase):
+    """Un id reemplazado antes del flush debe quedar una sola vez en el segmento."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.system = DocumentSystem(segment_dir=self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def reopen(self):
+        return DocumentSystem(segment_dir=self.directory)
+
+    def assert_single_version(self, system, doc_id, title):
+        self.assertIsNotNone(system.inverted_index.lookup(doc_id))
+        self.assertEqual(system.retrieve_document(doc_id).title, title)
+        self.assertEqual([doc.doc_id for doc in system.search_by_keyword(title.split()[-1])], [doc_id])
+
+    def test_agregado_dos_veces_en_memoria(self):
+        self.system.add_document(Document("abc", "alpha v1", "contenido", []))
+        self.system.add_document(Document("abc", "alpha v2", "contenido", []))
+        self.system.flush_segment()
+        self.assert_single_version(self.system, "abc", "alpha v2")
+        self.assert_single_version(self.reopen(), "abc", "alpha v2")
+        self.assertTrue(self.system.delete_document("abc"))
+        self.assertIsNone(self.system.inverted_index.lookup("abc"))
+
+    def test_persistido_actualizado_dos_veces(self):
+        self.system.add_document(Document("abc", "alpha v1", "contenido", []))
+        self.system.flush_segment()
+        self.system.update_document("abc", title="alpha v2")
+        self.system.update_document("abc", title="alpha v3")
+        self.system.flush_segment()
+        self.assert_single_version(self.system, "abc", "alpha v3")
+        reopened = self.reopen()
+        self.assert_single_version(reopened, "abc", "alpha v3")
+        self.assertTrue(reopened.delete_document("abc"))
+        self.assertIsNone(self.reopen().retrieve_document("abc"))
+
+
+class CacheDeConsultasTest(unittest.TestCase):
+    """Los scores cacheados dependen de N, la longitud media y los df."""
+
+    def test_alta_no_relacionada_invalida_scores(self):
+        system = DocumentSystem()
+        system.add_document(Document("a", "python", "python datos", []))
+        system.add_document(Document("b", "java", "java datos", []))
+        cached = system.search_by_keyword("python")[0].relevance_score
+        for i in range(20):
+            system.add_document(Document(f"x{i}", "rust", "rust sistemas", []))
+        fresh = system.search_by_keyword("python", use_cache=False)[0].relevance_score
+        self.assertNotAlmostEqual(cached, fresh)
+        self.assertAlmostEqual(system.search_by_keyword("python")[0].relevance_score, fresh)
+
+    def test_acceso_invalida_solo_sus_terminos(self):
+        system = DocumentSystem()
+        system.add_document(Document("a", "python", "python", []))
+        system.add_document(Document("b", "java", "java", []))
+        system.search_by_keyword("python")
+        system.search_by_keyword("java")
+        system.retrieve_document("a")
+        self.assertEqual(system.query_cache.stats()["entries"], 1)
+
+
+class ParticionesTest(unittest.TestCase):
+    """Con estadísticas globales el top-k particionado es el de un solo sistema."""
+
+    def test_mismo_top_k_que_sin_particionar(self):
+        docs = [Document(f"d{i:03d}", f"python {'datos ' * (i % 7)}", "texto " * i, [])
+                for i in range(120)]
+        single = DocumentSystem()
+        single.add_documents(docs, progress_every=0, workers=0)
+        expected = {(d.doc_id, round(d.relevance_score, 9)) for d in single.search_by_keyword("datos", top_k=10)}
+        with ShardedDocumentSystem(3) as sharded:
+            sharded.add_documents(docs)
+            got = {(d.doc_id, round(d.relevance_score, 9)) for d in sharded.search_by_keyword("datos", top_k=10)}
+        self.assertEqual(got, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
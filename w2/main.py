@@ -1,63 +1,931 @@
 """
 Unidad 2: Procesamiento de streams con Bloom Filter, Sampling, Conteo exacto,
 Momento 1 (F1) y DGIM sobre eventos de documentos.
+
+    python3 w2/main.py                                      # demo de 10 eventos
+    python3 w2/main.py --archivo w3/document_data_v2.json   # replay del log de w3
 """
 
+import argparse
+import asyncio
+import json
 import random
 import math
+import hashlib
+import heapq
+import logging
+import operator
+import os
+import pickle
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import deque
+from functools import lru_cache
+from itertools import islice
+
+# Módulos compartidos entre unidades, en la raíz del repositorio
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from comun.lectura_json import iter_json_records
 
 LINE = "=" * 70
 SUB = "-" * 70
 
+
+# ==============================================================================
+# ESTRUCTURAS: BLOOM FILTER Y BLOOM CON ENVEJECIMIENTO
+# ==============================================================================
+def _hashes_dobles(clave):
+    """
+    Dos hashes de 64 bits estables entre procesos (hash() de Python cambia
+    con cada ejecución). Doble hashing: h_i = h1 + i * h2.
+    """
+    digest = hashlib.blake2b(clave.encode("utf-8"), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1  # impar: recorre todas las posiciones
+    return h1, h2
+
+
+@lru_cache(maxsize=4096)
+def _posiciones_bloom(clave, num_bits, num_hashes):
+    # Caché acotada: las firmas del stream se repiten mucho (tipo + bucket)
+    h1, h2 = _hashes_dobles(clave)
+    return tuple((h1 + i * h2) % num_bits for i in range(num_hashes))
+
+
+class BloomFilter:
+    """
+    Filtro de Bloom sobre un bytearray de bits. El tamaño sale de la
+    capacidad esperada n y la tasa de falsos positivos p:
+        m = -n ln(p) / (ln 2)^2 bits,  k = (m / n) ln 2 hashes.
+    """
+
+    def __init__(self, capacidad, tasa_fp=0.01):
+        self.capacidad = capacidad
+        self.tasa_fp = tasa_fp
+        self.num_bits = max(8, math.ceil(-capacidad * math.log(tasa_fp) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacidad * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.insertados = 0
+
+    def posiciones(self, clave):
+        return _posiciones_bloom(clave, self.num_bits, self.num_hashes)
+
+    def agregar(self, clave):
+        for pos in self.posiciones(clave):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.insertados += 1
+
+    def contiene(self, clave):
+        bits = self.bits
+        return all(bits[pos >> 3] >> (pos & 7) & 1 for pos in self.posiciones(clave))
+
+    __contains__ = contiene
+
+    def tasa_fp_estimada(self):
+        """(1 - e^(-k n / m))^k con los elementos insertados hasta ahora."""
+        return (1 - math.exp(-self.num_hashes * self.insertados / self.num_bits)) ** self.num_hashes
+
+
+class AgingBloomFilter:
+    """
+    "¿Visto en los últimos W pasos?" con memoria constante: g generaciones
+    de Bloom, cada una cubre L = ceil(W / (g - 1)) pasos. Al avanzar se
+    vacía la generación más vieja. Sin falsos negativos dentro de la
+    ventana; puede responder "reciente" hasta L pasos de más.
+    """
+
+    def __init__(self, ventana, capacidad, tasa_fp=0.01, generaciones=4):
+        self.ventana = ventana
+        self.generaciones = max(2, generaciones)
+        self.paso_generacion = max(1, math.ceil(ventana / (self.generaciones - 1)))
+        self.filtros = [BloomFilter(capacidad, tasa_fp) for _ in range(self.generaciones)]
+        self.generacion_actual = 0
+
+    def avanzar(self, paso):
+        generacion = paso // self.paso_generacion
+        vencidas = min(generacion - self.generacion_actual, self.generaciones)
+        for i in range(1, vencidas + 1):
+            filtro = self.filtros[(self.generacion_actual + i) % self.generaciones]
+            filtro.bits[:] = bytes(len(filtro.bits))
+            filtro.insertados = 0
+        self.generacion_actual = max(self.generacion_actual, generacion)
+
+    def agregar(self, clave, paso):
+        self.avanzar(paso)
+        self.filtros[self.generacion_actual % self.generaciones].agregar(clave)
+
+    def contiene(self, clave, paso):
+        self.avanzar(paso)
+        # Las posiciones son las mismas en todas las generaciones
+        posiciones = self.filtros[0].posiciones(clave)
+        for filtro in self.filtros:
+            bits = filtro.bits
+            if all(bits[pos >> 3] >> (pos & 7) & 1 for pos in posiciones):
+                return True
+        return False
+
+
+# ==============================================================================
+# ESTRUCTURAS: DGIM (un stream y muchos streams)
+# ==============================================================================
+class DGIM:
+    """
+    Cuenta aproximada de 1s en los últimos W bits. Los buckets se agrupan
+    por tamaño: niveles[j] es un deque con los tiempos finales de los
+    buckets de tamaño 2^j (el más reciente a la izquierda). Con r - 1 a r
+    buckets por tamaño el error relativo de estimate() tiende a 1/(2(r-1))
+    cuando crecen los buckets (r=2 es el DGIM clásico, error <= 50%).
+    Cada bit cuesta O(1) amortizado y O(log W) en el peor caso.
+    """
+
+    def __init__(self, ventana, r=2):
+        if r < 2:
+            raise ValueError("r debe ser >= 2")
+        self.ventana = ventana
+        self.r = r
+        self.tiempo = 0
+        self.niveles = []
+
+    def cota_error(self):
+        # Cota asintótica; con muy pocos 1s en la ventana puede llegar a 1/r
+        return 1 / (2 * (self.r - 1))
+
+    def _expirar(self):
+        # El bucket más viejo está al final del nivel más alto
+        niveles = self.niveles
+        limite = self.tiempo - self.ventana
+        while niveles:
+            nivel = niveles[-1]
+            while nivel and nivel[-1] <= limite:
+                nivel.pop()
+            if nivel:
+                break
+            niveles.pop()
+
+    def agregar(self, bit):
+        self.tiempo += 1
+        self._expirar()
+        if not bit:
+            return
+        niveles = self.niveles
+        tiempo_final = self.tiempo
+        j = 0
+        while True:
+            if j == len(niveles):
+                niveles.append(deque())
+            nivel = niveles[j]
+            nivel.appendleft(tiempo_final)
+            if len(nivel) <= self.r:
+                return
+            # Fusionar los dos más viejos de este tamaño: el nuevo bucket
+            # conserva el tiempo del más reciente y sube al nivel siguiente
+            nivel.pop()
+            tiempo_final = nivel.pop()
+            j += 1
+
+    def estimate(self, k=None):
+        """1s estimados en los últimos k bits (k <= ventana; None = ventana)."""
+        k = self.ventana if k is None else min(k, self.ventana)
+        limite = self.tiempo - k
+        total = ultimo = 0
+        for j, nivel in enumerate(self.niveles):
+            for tiempo_final in nivel:
+                if tiempo_final <= limite:
+                    return total - ultimo // 2
+                ultimo = 1 << j
+                total += ultimo
+        # Solo el bucket más viejo puede estar parcialmente fuera de la ventana
+        return total - ultimo // 2
+
+    def buckets(self):
+        """[[tamaño, tiempo_final], ...] del más reciente al más viejo."""
+        return [[1 << j, t] for j, nivel in enumerate(self.niveles) for t in nivel]
+
+
+class MultiStreamDGIM:
+    """
+    Muchos DGIM independientes (p. ej. uno por tipo de documento) sobre un
+    reloj común, en arreglos planos: para cada stream y nivel hay r + 1
+    ranuras de tiempos en un array('q') y un contador en un bytearray.
+    Cada evento es un tick del reloj y un 1 en un solo stream; los demás
+    reciben 0 implícitamente, sin tocarlos.
+    """
+
+    def __init__(self, ventana, r=2, num_streams=0):
+        if r < 2:
+            raise ValueError("r debe ser >= 2")
+        self.ventana = ventana
+        self.r = r
+        self.tiempo = 0
+        self.num_niveles = ventana.bit_length() + 1
+        self.num_streams = 0
+        self.tiempos = array('q')
+        self.cuentas = bytearray()
+        for _ in range(num_streams):
+            self.nuevo_stream()
+
+    def nuevo_stream(self):
+        """Agrega un stream vacío y retorna su índice."""
+        self.tiempos.extend(bytes(8 * self.num_niveles * (self.r + 1)))
+        self.cuentas.extend(bytes(self.num_niveles))
+        self.num_streams += 1
+        return self.num_streams - 1
+
+    def _expirar(self, stream):
+        limite = self.tiempo - self.ventana
+        cuentas, tiempos, ranuras = self.cuentas, self.tiempos, self.r + 1
+        inicio = stream * self.num_niveles
+        for j in range(self.num_niveles - 1, -1, -1):
+            c = cuentas[inicio + j]
+            if not c:
+                continue
+            base = (inicio + j) * ranuras
+            while c and tiempos[base + c - 1] <= limite:
+                c -= 1
+            cuentas[inicio + j] = c
+            if c:
+                return
+
+    def avanzar(self):
+        """Tick del reloj sin 1s (evento que no pertenece a ningún stream)."""
+        self.tiempo += 1
+
+    def agregar(self, stream):
+        """Tick del reloj con un 1 en `stream`."""
+        self.tiempo += 1
+        self._expirar(stream)
+        cuentas, tiempos, ranuras = self.cuentas, self.tiempos, self.r + 1
+        inicio = stream * self.num_niveles
+        tiempo_final = self.tiempo
+        for j in range(self.num_niveles):
+            base = (inicio + j) * ranuras
+            c = cuentas[inicio + j]
+            # Ranura 0 = más reciente: se corre el nivel una posición
+            tiempos[base + 1:base + c + 1] = tiempos[base:base + c]
+            tiempos[base] = tiempo_final
+            c += 1
+            if c <= self.r:
+                cuentas[inicio + j] = c
+                return
+            tiempo_final = tiempos[base + c - 2]
+            cuentas[inicio + j] = c - 2
+
+    def estimate(self, stream, k=None):
+        k = self.ventana if k is None else min(k, self.ventana)
+        self._expirar(stream)
+        limite = self.tiempo - k
+        cuentas, tiempos, ranuras = self.cuentas, self.tiempos, self.r + 1
+        inicio = stream * self.num_niveles
+        total = ultimo = 0
+        for j in range(self.num_niveles):
+            base = (inicio + j) * ranuras
+            for i in range(cuentas[inicio + j]):
+                if tiempos[base + i] <= limite:
+                    return total - ultimo // 2
+                ultimo = 1 << j
+                total += ultimo
+        return total - ultimo // 2
+
+
+# ==============================================================================
+# ESTRUCTURAS: HYPERLOGLOG (conteo aproximado de distintos)
+# ==============================================================================
+class HyperLogLog:
+    """
+    Estimador de cardinalidad con m = 2^precision registros de un byte.
+    El hash de 64 bits se parte en p bits de índice y el resto, cuyo rango
+    (posición del primer 1) se guarda como máximo por registro. Error
+    estándar ≈ 1.04 / sqrt(m): 3.2% con p=10 en 1 KiB.
+
+    Como en HLL++, empieza disperso: un array('I') ordenado de códigos
+    (índice << 6 | rango) que solo ocupa 4 bytes por registro tocado. Pasa al
+    bytearray denso cuando ese arreglo ocuparía más que la mitad del denso.
+    Dos sketches de igual precisión se fusionan con el máximo por registro.
+    """
+
+    def __init__(self, precision=10, disperso=True):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision debe estar entre 4 y 16")
+        self.precision = precision
+        self.m = 1 << precision
+        self._bits_resto = 64 - precision
+        self._mascara = (1 << self._bits_resto) - 1
+        self.disperso = array('I') if disperso else None
+        self.registros = None if disperso else bytearray(self.m)
+
+    def cota_error(self):
+        return 1.04 / math.sqrt(self.m)
+
+    def _indice_rango(self, clave):
+        h = _hashes_dobles(clave)[0]
+        return h >> self._bits_resto, self._bits_resto - (h & self._mascara).bit_length() + 1
+
+    def agregar(self, clave):
+        indice, rango = self._indice_rango(str(clave))
+        registros = self.registros
+        if registros is not None:
+            if rango > registros[indice]:
+                registros[indice] = rango
+            return
+        disperso = self.disperso
+        codigo = indice << 6 | rango
+        i = bisect_left(disperso, indice << 6)
+        if i < len(disperso) and disperso[i] >> 6 == indice:
+            if codigo > disperso[i]:
+                disperso[i] = codigo
+            return
+        disperso.insert(i, codigo)
+        if len(disperso) * 4 > self.m // 2:
+            self._densificar()
+
+    def _densificar(self):
+        registros = bytearray(self.m)
+        for codigo in self.disperso:
+            registros[codigo >> 6] = codigo & 63
+        self.registros = registros
+        self.disperso = None
+
+    def fusionar(self, otro):
+        """Une `otro` en este sketch (máximo por registro) y retorna self."""
+        if otro.precision != self.precision:
+            raise ValueError("solo se fusionan sketches con la misma precisión")
+        if otro.registros is None and self.registros is None:
+            for codigo in otro.disperso:
+                i = bisect_left(self.disperso, codigo & ~63)
+                if i < len(self.disperso) and self.disperso[i] >> 6 == codigo >> 6:
+                    self.disperso[i] = max(self.disperso[i], codigo)
+                else:
+                    self.disperso.insert(i, codigo)
+            if len(self.disperso) * 4 > self.m // 2:
+                self._densificar()
+            return self
+        if self.registros is None:
+            self._densificar()
+        registros = self.registros
+        if otro.registros is None:
+            for codigo in otro.disperso:
+                indice, rango = codigo >> 6, codigo & 63
+                if rango > registros[indice]:
+                    registros[indice] = rango
+        else:
+            self.registros = bytearray(map(max, registros, otro.registros))
+        return self
+
+    def estimar(self):
+        m = self.m
+        if self.registros is None:
+            # Disperso: pocos registros tocados, rango de conteo lineal
+            ceros = m - len(self.disperso)
+            return round(m * math.log(m / ceros))
+        registros = self.registros
+        suma = math.fsum(2.0 ** -r for r in registros)
+        alfa = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimacion = alfa * m * m / suma
+        if estimacion <= 2.5 * m:
+            ceros = registros.count(0)
+            if ceros:
+                estimacion = m * math.log(m / ceros)
+        return round(estimacion)
+
+    def __getstate__(self):
+        # Compacto para los snapshots: precisión y registros crudos
+        if self.registros is not None:
+            return self.precision, False, bytes(self.registros)
+        return self.precision, True, self.disperso.tobytes()
+
+    def __setstate__(self, estado):
+        precision, disperso, datos = estado
+        self.__init__(precision, disperso)
+        if disperso:
+            self.disperso.frombytes(datos)
+        else:
+            self.registros[:] = datos
+
+    def memoria(self):
+        """Bytes ocupados por los registros (sin la cabecera del objeto)."""
+        return len(self.registros) if self.registros is not None else 4 * len(self.disperso)
+
+
+# ==============================================================================
+# ESTRUCTURAS: COUNT-MIN, HEAVY HITTERS Y AMS (F2)
+# ==============================================================================
+class CountMinSketch:
+    """
+    Tabla de d filas x w contadores. Cada clave suma en una celda por fila y
+    la estimación es el mínimo: nunca subestima y, con w = ⌈e/ε⌉ y
+    d = ⌈ln(1/δ)⌉, sobreestima a lo sumo ε·N con probabilidad 1 - δ.
+    Dos sketches con las mismas dimensiones se fusionan sumando celdas.
+    """
+
+    def __init__(self, epsilon=0.001, delta=0.01):
+        self.ancho = math.ceil(math.e / epsilon)
+        self.profundidad = math.ceil(math.log(1 / delta))
+        self.tabla = array('q', bytes(8 * self.ancho * self.profundidad))
+        self.total = 0
+
+    def _celdas(self, clave):
+        # Mismas posiciones por doble hashing (y misma caché) que el Bloom
+        ancho = self.ancho
+        return [fila * ancho + pos for fila, pos in enumerate(_posiciones_bloom(clave, ancho, self.profundidad))]
+
+    def agregar(self, clave, cuenta=1):
+        """Suma `cuenta` a la clave y retorna su nueva estimación."""
+        tabla = self.tabla
+        estimacion = None
+        for celda in self._celdas(clave):
+            tabla[celda] += cuenta
+            if estimacion is None or tabla[celda] < estimacion:
+                estimacion = tabla[celda]
+        self.total += cuenta
+        return estimacion
+
+    def estimar(self, clave):
+        tabla = self.tabla
+        return min(tabla[celda] for celda in self._celdas(clave))
+
+    def fusionar(self, otro):
+        if (otro.ancho, otro.profundidad) != (self.ancho, self.profundidad):
+            raise ValueError("solo se fusionan sketches con las mismas dimensiones")
+        self.tabla = array('q', map(operator.add, self.tabla, otro.tabla))
+        self.total += otro.total
+        return self
+
+
+class HeavyHitters:
+    """
+    Top-k aproximado: Count-Min para las frecuencias y un min-heap con los k
+    candidatos. Las entradas del heap se invalidan de forma perezosa (se
+    vuelve a empujar la clave con su nueva cuenta) y el heap se reconstruye
+    cuando acumula demasiadas entradas viejas. Memoria fija: O(w·d + k).
+    """
+
+    def __init__(self, k=5, epsilon=0.001, delta=0.01):
+        self.k = k
+        self.cms = CountMinSketch(epsilon, delta)
+        self.candidatos = {}  # clave -> cuenta estimada vigente
+        self._heap = []
+
+    def agregar(self, clave, cuenta=1):
+        estimacion = self.cms.agregar(clave, cuenta)
+        candidatos = self.candidatos
+        if clave in candidatos or len(candidatos) < self.k:
+            candidatos[clave] = estimacion
+            heapq.heappush(self._heap, (estimacion, clave))
+            if len(self._heap) > 4 * self.k + 16:
+                self._reconstruir()
+            return
+        minimo = self._minimo()
+        if estimacion > minimo[0]:
+            heapq.heappop(self._heap)
+            del candidatos[minimo[1]]
+            candidatos[clave] = estimacion
+            heapq.heappush(self._heap, (estimacion, clave))
+
+    def _minimo(self):
+        # Descarta entradas cuya cuenta ya no es la vigente del candidato
+        heap, candidatos = self._heap, self.candidatos
+        while candidatos.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0]
+
+    def _reconstruir(self):
+        self._heap = [(cuenta, clave) for clave, cuenta in self.candidatos.items()]
+        heapq.heapify(self._heap)
+
+    def top(self):
+        """[(clave, cuenta_estimada), ...] de mayor a menor."""
+        return sorted(self.candidatos.items(), key=lambda item: (-item[1], item[0]))
+
+    def fusionar(self, otro):
+        """Suma los sketches y re-estima la unión de candidatos de ambos."""
+        self.cms.fusionar(otro.cms)
+        claves = set(self.candidatos) | set(otro.candidatos)
+        mejores = heapq.nlargest(self.k, ((self.cms.estimar(c), c) for c in claves))
+        self.candidatos = {clave: cuenta for cuenta, clave in mejores}
+        self._reconstruir()
+        return self
+
+
+@lru_cache(maxsize=4096)
+def _signos_ams(clave, num_bytes):
+    # Un bit del hash por contador: 1 -> +1, 0 -> -1
+    return int.from_bytes(hashlib.blake2b(clave.encode("utf-8"), digest_size=num_bytes).digest(), "little")
+
+
+class AMSSketch:
+    """
+    Estimador AMS ("tug of war") del segundo momento F2 = Σ f_x² (número
+    sorpresa). Cada contador suma ±cuenta según un signo pseudoaleatorio de
+    la clave; Z² estima F2 y se toma la mediana de los promedios de
+    `grupos` grupos de `por_grupo` contadores (error ≈ √(2/por_grupo)).
+    Es lineal: dos sketches se fusionan sumando contadores.
+
+    Las llegadas se acumulan en un búfer acotado por clave y se aplican en
+    bloque, así una clave repetida cuesta una suma en un dict y no un
+    recorrido de todos los contadores.
+    """
+
+    MAX_PENDIENTES = 256
+
+    def __init__(self, grupos=5, por_grupo=32):
+        self.grupos = grupos
+        self.por_grupo = por_grupo
+        self.num_contadores = grupos * por_grupo
+        if self.num_contadores > 512:
+            raise ValueError("a lo sumo 512 contadores (64 bytes de hash)")
+        self._num_bytes = (self.num_contadores + 7) // 8
+        self.contadores = [0] * self.num_contadores
+        self._pendientes = {}
+
+    def agregar(self, clave, cuenta=1):
+        pendientes = self._pendientes
+        pendientes[clave] = pendientes.get(clave, 0) + cuenta
+        if len(pendientes) >= self.MAX_PENDIENTES:
+            self._aplicar()
+
+    def _aplicar(self):
+        contadores = self.contadores
+        for clave, cuenta in self._pendientes.items():
+            signos = _signos_ams(clave, self._num_bytes)
+            for j in range(self.num_contadores):
+                if signos >> j & 1:
+                    contadores[j] += cuenta
+                else:
+                    contadores[j] -= cuenta
+        self._pendientes.clear()
+
+    def estimar(self):
+        self._aplicar()
+        c, g = self.contadores, self.por_grupo
+        promedios = sorted(sum(z * z for z in c[i:i + g]) / g for i in range(0, len(c), g))
+        return round(promedios[len(promedios) // 2])
+
+    def fusionar(self, otro):
+        if (otro.grupos, otro.por_grupo) != (self.grupos, self.por_grupo):
+            raise ValueError("solo se fusionan sketches con las mismas dimensiones")
+        self._aplicar()
+        otro._aplicar()
+        self.contadores = [a + b for a, b in zip(self.contadores, otro.contadores)]
+        return self
+
+
+# ==============================================================================
+# ESTRUCTURAS: HASH UNIVERSAL Y RESERVORIO
+# ==============================================================================
+PRIMO_MERSENNE = (1 << 61) - 1
+
+
+class HashUniversal:
+    """
+    Familia de Carter-Wegman: h(x) = ((a·x + b) mod p) mod buckets con
+    p = 2^61 - 1 y a, b al azar. Las claves no enteras se llevan primero a
+    un entero estable de 64 bits.
+    """
+
+    def __init__(self, buckets, rng=None):
+        rng = rng or random.Random()
+        self.buckets = buckets
+        self.a = rng.randrange(1, PRIMO_MERSENNE)
+        self.b = rng.randrange(PRIMO_MERSENNE)
+
+    def __call__(self, clave):
+        if not isinstance(clave, int):
+            clave = _hashes_dobles(str(clave))[0]
+        return (self.a * clave + self.b) % PRIMO_MERSENNE % self.buckets
+
+
+class Reservorio:
+    """
+    Muestra uniforme de tamaño fijo k sobre un stream de largo desconocido
+    (Algoritmo L de Li): en vez de sortear cada elemento como el Algoritmo
+    R, calcula cuántos saltar hasta el próximo reemplazo, así el costo por
+    elemento no muestreado es una comparación.
+    """
+
+    def __init__(self, k, rng=None):
+        if k < 1:
+            raise ValueError("k debe ser >= 1")
+        self.k = k
+        self.rng = rng or random.Random()
+        self.elementos = []
+        self.vistos = 0
+        self._w = 1.0
+        self._siguiente = k
+
+    def _sortear_salto(self):
+        rng = self.rng
+        self._w *= math.exp(math.log(1.0 - rng.random()) / self.k)
+        salto = math.floor(math.log(1.0 - rng.random()) / math.log1p(-self._w))
+        self._siguiente = self.vistos + salto + 1
+
+    def agregar(self, elemento):
+        """Ofrece un elemento; retorna True si quedó en la muestra."""
+        indice = self.vistos
+        self.vistos += 1
+        if indice < self.k:
+            self.elementos.append(elemento)
+            if self.vistos == self.k:
+                self._sortear_salto()
+            return True
+        if indice + 1 < self._siguiente:
+            return False
+        self.elementos[self.rng.randrange(self.k)] = elemento
+        self._sortear_salto()
+        return True
+
+
+# ==============================================================================
+# PERSISTENCIA: SNAPSHOTS COMPLETOS E INCREMENTALES
+# ==============================================================================
+SNAPSHOT_MAGIC = b"W2SNAP"
+SNAPSHOT_VERSION = 1
+# magic, versión, tipo (0 completo, 1 delta), base (número del completo),
+# secuencia del delta (0 en el completo) y cantidad de secciones
+SNAPSHOT_HEADER = struct.Struct("<6sHBIII")
+# modo, nombre, largo del contenido. Al final del archivo va el CRC32 de todo
+# lo anterior
+SNAPSHOT_SECTION = struct.Struct("<B16sQ")
+SECCION_CRUDA, SECCION_PICKLE, SECCION_PAGINAS = 0, 1, 2
+PAGINA = 4096
+PAGINAS_HEADER = struct.Struct("<QI")
+
+
+def _diferencia_paginas(anterior, actual):
+    """Solo las páginas de PAGINA bytes que cambiaron desde `anterior`."""
+    partes = []
+    cambiadas = 0
+    vista_ant, vista = memoryview(anterior), memoryview(actual)
+    for inicio in range(0, len(actual), PAGINA):
+        pagina = vista[inicio:inicio + PAGINA]
+        if pagina != vista_ant[inicio:inicio + PAGINA]:
+            partes.append(struct.pack("<I", inicio // PAGINA))
+            partes.append(pagina)
+            cambiadas += 1
+    return PAGINAS_HEADER.pack(len(actual), cambiadas) + b"".join(partes)
+
+
+def _aplicar_paginas(destino, contenido):
+    largo, cambiadas = PAGINAS_HEADER.unpack_from(contenido)
+    if len(destino) != largo:
+        raise ValueError("el delta no corresponde al tamaño de la estructura")
+    pos = PAGINAS_HEADER.size
+    for _ in range(cambiadas):
+        (indice,) = struct.unpack_from("<I", contenido, pos)
+        inicio = indice * PAGINA
+        fin = min(inicio + PAGINA, largo)
+        pos += 4
+        destino[inicio:fin] = contenido[pos:pos + fin - inicio]
+        pos += fin - inicio
+
+
+def _escribir_snapshot(ruta, tipo, base, secuencia, secciones):
+    """secciones: [(modo, nombre, bytes)]. Escritura atómica (tmp + os.replace)."""
+    crc = 0
+    tmp = ruta + ".tmp"
+    with open(tmp, "wb") as f:
+        cabecera = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, tipo, base, secuencia, len(secciones))
+        f.write(cabecera)
+        crc = zlib.crc32(cabecera, crc)
+        for modo, nombre, contenido in secciones:
+            cabecera = SNAPSHOT_SECTION.pack(modo, nombre.encode("ascii"), len(contenido))
+            f.write(cabecera)
+            f.write(contenido)
+            crc = zlib.crc32(contenido, zlib.crc32(cabecera, crc))
+        f.write(struct.pack("<I", crc))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, ruta)
+
+
+def _leer_snapshot(ruta):
+    """Retorna (tipo, base, secuencia, {nombre: (modo, contenido)})."""
+    with open(ruta, "rb") as f:
+        datos = f.read()
+    if len(datos) < SNAPSHOT_HEADER.size + 4 or datos[:6] != SNAPSHOT_MAGIC:
+        raise ValueError(f"{ruta}: no es un snapshot de w2")
+    if zlib.crc32(memoryview(datos)[:-4]) != struct.unpack_from("<I", datos, len(datos) - 4)[0]:
+        raise ValueError(f"{ruta}: CRC inválido")
+    _, version, tipo, base, secuencia, num_secciones = SNAPSHOT_HEADER.unpack_from(datos)
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"{ruta}: versión de snapshot no soportada: {version}")
+    secciones = {}
+    pos = SNAPSHOT_HEADER.size
+    for _ in range(num_secciones):
+        modo, nombre, largo = SNAPSHOT_SECTION.unpack_from(datos, pos)
+        pos += SNAPSHOT_SECTION.size
+        secciones[nombre.rstrip(b"\x00").decode("ascii")] = (modo, datos[pos:pos + largo])
+        pos += largo
+    return tipo, base, secuencia, secciones
+
+
+class Checkpointer:
+    """
+    Guarda el estado de un SistemaProcesamiento cada `cada` eventos. Cada
+    `completo_cada` deltas escribe un snapshot completo; en medio, deltas
+    con solo las páginas de 4 KiB que cambiaron en los arreglos grandes
+    (Bloom, generaciones, Count-Min), los usuarios tocados desde el
+    checkpoint anterior y el estado chico (DGIM, contadores, muestra), que
+    ocupa O(log W + muestra) y se guarda entero.
+
+    En el hilo de ingesta solo se copian los bytes y se serializa el estado
+    chico; el diff de páginas, la escritura y el fsync van en un hilo de
+    fondo (a lo sumo uno en vuelo). La base de los deltas (secuencia,
+    páginas previas, usuarios tocados) solo avanza cuando la escritura
+    termina bien; tras un fallo el próximo checkpoint es completo.
+    """
+
+    def __init__(self, sistema, directorio, cada=50_000, completo_cada=8, en_segundo_plano=True):
+        self.sistema = sistema
+        self.directorio = directorio
+        self.cada = cada
+        self.completo_cada = completo_cada
+        self.en_segundo_plano = en_segundo_plano
+        os.makedirs(directorio, exist_ok=True)
+        bases = [base for base, _ in _archivos_snapshot(directorio)]
+        self.base = max(bases, default=0)
+        self.secuencia = None  # None: todavía no hay completo propio
+        self.proximo = sistema.paso + cada
+        self._previos = {}
+        self._hilo = None
+        self.error = None  # error de la última escritura (None si salió bien)
+        self._sucios_fallidos = None
+
+    def guardar(self, completo=None):
+        sistema = self.sistema
+        # La escritura anterior define la base de este delta
+        self.esperar()
+        if self._sucios_fallidos is not None:
+            sistema._sucios |= self._sucios_fallidos
+            self._sucios_fallidos = None
+        if completo is None:
+            completo = self.secuencia is None or self.secuencia >= self.completo_cada
+        if self.error is not None:
+            completo = True
+        crudas = {nombre: bytes(arreglo) for nombre, arreglo in sistema._secciones_crudas().items()}
+        sucios, sistema._sucios = sistema._sucios, set()
+        chicas = [
+            (SECCION_PICKLE, "estado", zlib.compress(pickle.dumps(sistema._estado_chico(), pickle.HIGHEST_PROTOCOL), 1)),
+            (SECCION_PICKLE, "usuarios", zlib.compress(pickle.dumps(sistema._estado_usuarios(None if completo else sucios),
+                                                                    pickle.HIGHEST_PROTOCOL), 1)),
+        ]
+        self.proximo = sistema.paso + self.cada
+        if completo:
+            base, secuencia = self.base + 1, 0
+        else:
+            base, secuencia = self.base, self.secuencia + 1
+        argumentos = (completo, base, secuencia, crudas, chicas, sucios)
+        if self.en_segundo_plano:
+            self._hilo = threading.Thread(target=self._escribir, args=argumentos, daemon=True)
+            self._hilo.start()
+        else:
+            self._escribir(*argumentos)
+
+    def _escribir(self, completo, base, secuencia, crudas, chicas, sucios):
+        try:
+            secciones = list(chicas)
+            for nombre, actual in crudas.items():
+                anterior = self._previos.get(nombre)
+                if completo or anterior is None or len(anterior) != len(actual):
+                    secciones.append((SECCION_CRUDA, nombre, actual))
+                else:
+                    secciones.append((SECCION_PAGINAS, nombre, _diferencia_paginas(anterior, actual)))
+            if completo:
+                _escribir_snapshot(os.path.join(self.directorio, f"w2-{base:06d}.snap"), 0, base, 0, secciones)
+            else:
+                _escribir_snapshot(os.path.join(self.directorio, f"w2-{base:06d}-{secuencia:06d}.delta"),
+                                   1, base, secuencia, secciones)
+        except Exception as exc:  # el hilo de fondo no puede propagar
+            # Los usuarios tocados vuelven a la cuenta y el próximo es completo
+            self.error = exc
+            self._sucios_fallidos = sucios
+            self.sistema.log.error("[Checkpoint] falló la escritura: %s", exc)
+            return
+        # Solo ahora el estado escrito pasa a ser la base del próximo delta
+        self._previos = crudas
+        self.base, self.secuencia = base, secuencia
+        self.error = None
+        self.sistema.log.info("[Checkpoint] %s %d/%d escrito", "completo" if completo else "delta", base, secuencia)
+        if completo:
+            # Los completos y deltas anteriores ya no hacen falta
+            for viejo, ruta in _archivos_snapshot(self.directorio):
+                if viejo < base:
+                    try:
+                        os.remove(ruta)
+                    except OSError:
+                        pass
+
+    def esperar(self):
+        """Bloquea hasta que termine la escritura en curso, si hay una."""
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+
+
+def _archivos_snapshot(directorio):
+    """[(base, ruta)] de los snapshots y deltas en el directorio."""
+    archivos = []
+    for nombre in os.listdir(directorio):
+        if nombre.startswith("w2-") and nombre.endswith((".snap", ".delta")):
+            base = nombre[3:9]
+            if base.isdigit():
+                archivos.append((int(base), os.path.join(directorio, nombre)))
+    return archivos
+
+
 class SistemaProcesamiento:
-    def __init__(self):
+    def __init__(self, bloom_capacidad=10_000, bloom_tasa_fp=0.01, recency_window=5, logger=None,
+                 window_size=32, dgim_r=2, conteo_distinto="exacto", hll_precision=10,
+                 clave_distinta="documentType", top_k=5, cms_epsilon=0.001, cms_delta=0.01,
+                 modo_muestreo="umbral", sample_size_limit=3, sample_buckets=1 << 20,
+                 max_eventos_usuario=100, reservorio_tamano=100, semilla=None):
+        # Parámetros de construcción: se guardan en los snapshots
+        self._config = {k: v for k, v in locals().items() if k not in ("self", "logger")}
+        # Bitácora enchufable: cualquier logging.Logger. Las trazas por evento
+        # van en DEBUG; sin handler configurado no se formatea nada.
+        self.log = logger if logger is not None else logging.getLogger(__name__)
+        self.paso = 0  # eventos procesados (reloj del stream)
+
         # ---------------------------------------------------------
         # 1. BLOOM FILTER (Filtro de Bloom)
-        # Teoría: Array de N bits inicializados en 0.
+        # Teoría: Array de m bits inicializados en 0 y k hashes.
         # ---------------------------------------------------------
-        self.bloom_size = 20  # Tamaño pequeño para ver efectos en la demo
-        self.bloom_array = [0] * self.bloom_size
-        # Recencia por firma simple de contenido
-        self.bloom_last_seen = {}
-        self.recency_window = 5  # pasos recientes que consideramos
+        self.bloom = BloomFilter(bloom_capacidad, bloom_tasa_fp)
+        # Recencia por firma simple de contenido, en memoria constante
+        self.recency_window = recency_window  # pasos recientes que consideramos
+        self.bloom_reciente = AgingBloomFilter(recency_window, bloom_capacidad, bloom_tasa_fp)
         
         # ---------------------------------------------------------
         # 2. BEHAVIOR SAMPLING (Muestreo) - Algoritmo 3
-        # Teoría: Hash consistente y umbral dinámico.
+        # Teoría: Hash consistente y umbral dinámico ("umbral"), o una
+        # muestra uniforme de eventos de tamaño fijo ("reservorio").
         # ---------------------------------------------------------
-        self.sample_buckets = 10     # 'b' en la teoría
-        self.sample_size_limit = 3   # 'm' (tamaño máximo de muestra)
+        if modo_muestreo not in ("umbral", "reservorio"):
+            raise ValueError("modo_muestreo debe ser 'umbral' o 'reservorio'")
+        self.modo_muestreo = modo_muestreo
+        self.rng = random.Random(semilla)
+        self.sample_buckets = sample_buckets         # 'b' en la teoría
+        self.sample_size_limit = sample_size_limit   # 'm' (tamaño máximo de muestra)
         self.threshold = self.sample_buckets - 1 # Empieza permisivo
-        self.sample = {}             # Aquí guardamos los usuarios elegidos
-        
-        # Constantes para la función hash (a * user + c)
-        self.hash_a = 3
-        self.hash_c = 7
+        self.sample = {}             # usuario -> últimos eventos (a lo sumo max_eventos_usuario)
+        self.max_eventos_usuario = max_eventos_usuario
+        # Índice bucket -> usuarios muestreados y max-heap (negado) de buckets
+        # ocupados: el desalojo borra un bucket entero sin recorrer la muestra
+        self.sample_por_bucket = {}
+        self._buckets_ocupados = []
+
+        # Hash universal h(user) = ((a * user + c) mod p) mod buckets
+        self.hash_usuario = HashUniversal(self.sample_buckets, self.rng)
+        self.hash_a = self.hash_usuario.a
+        self.hash_c = self.hash_usuario.b
+        self.reservorio = Reservorio(reservorio_tamano, self.rng) if modo_muestreo == "reservorio" else None
 
         # ---------------------------------------------------------
-        # 3. DISTINCT COUNTING (Conteo Exacto)
-        # Teoría: Estructura exacta (mapa/set) por usuario.
+        # 3. DISTINCT COUNTING (Conteo Exacto y/o HyperLogLog)
+        # Teoría: Estructura exacta (mapa/set) por usuario; en modo
+        # "aproximado" un HyperLogLog por usuario en memoria acotada, y en
+        # "ambos" se mantienen los dos para validar el error.
         # ---------------------------------------------------------
+        if conteo_distinto not in ("exacto", "aproximado", "ambos"):
+            raise ValueError("conteo_distinto debe ser 'exacto', 'aproximado' o 'ambos'")
+        self.conteo_distinto = conteo_distinto
+        self.hll_precision = hll_precision
+        self.clave_distinta = clave_distinta  # campo del evento que se cuenta
         self.user_distinct_docs = {}
+        self.user_distinct_hll = {}
         self.user_doc_count = {}  # Conteo exacto de documentos por usuario
 
         # ---------------------------------------------------------
-        # 4. FREQUENCY MOMENTS (Momento 1)
+        # 4. FREQUENCY MOMENTS (Momento 1 y 2) y HEAVY HITTERS
         # Teoría: F1 = Suma total de las frecuencias (longitud del stream).
+        # F2 (AMS) mide qué tan sesgado está el stream; Count-Min + heap da
+        # los tipos y buckets de frecuencia dominantes. Memoria fija.
         # ---------------------------------------------------------
         self.F1_total = 0
+        self.ams_tipos = AMSSketch()
+        self.hh_tipos = HeavyHitters(top_k, cms_epsilon, cms_delta)
+        self.hh_frecuencias = HeavyHitters(top_k, cms_epsilon, cms_delta)
 
         # ---------------------------------------------------------
         # 5. DGIM ALGORITHM
         # Teoría: Ventana deslizante, buckets potencias de 2.
         # ---------------------------------------------------------
-        self.current_timestamp = 0
-        self.window_size = 32
-        # Lista de buckets. Cada bucket es: [tamaño, tiempo_final]
-        self.dgim_buckets = []
+        self.window_size = window_size
+        # Buckets agrupados por tamaño; dgim_r = máximo de buckets por tamaño
+        self.dgim = DGIM(window_size, dgim_r)
+        # Un stream por tipo de documento sobre el mismo reloj
+        self.dgim_tipos = MultiStreamDGIM(window_size, dgim_r)
+        self.tipo_stream = {}
         # Ruta preferida para usuarios muestreados
         self.routing_choice = {}
 
+        # Checkpoints (activar_checkpoints): usuarios tocados desde el último
+        self.checkpointer = None
+        self._sucios = None
+
     # ==============================================================================
     # 1. LÓGICA BLOOM FILTER
     # ==============================================================================
@@ -69,31 +937,21 @@ class SistemaProcesamiento:
         freq_bucket = search_freq // 10 if search_freq is not None else None
         signature = f"{document_type.lower()}_{freq_bucket}" if freq_bucket is not None else document_type.lower()
 
-        # Hash 1: Suma de ASCII ponderada
-        val_ascii = sum(ord(c) for c in signature)
-        pos1 = (val_ascii * 7) % self.bloom_size
-
-        # Hash 2: Posiciones con desplazamiento
-        pos2 = (val_ascii * 13 + 5) % self.bloom_size
-
-        # Hash 3: hash nativo de Python
-        pos3 = (hash(signature) * 11 + 17) % self.bloom_size
-
-        positions = (pos1, pos2, pos3)
-
         # Verificamos recencia: todos los bits en 1 y visto en ventana reciente
-        seen = all(self.bloom_array[p] == 1 for p in positions)
-        recent = signature in self.bloom_last_seen and (step - self.bloom_last_seen[signature]) <= self.recency_window
+        seen = self.bloom.contiene(signature)
+        recent = seen and self.bloom_reciente.contiene(signature, step)
 
-        if seen and recent:
-            print(f"[Bloom] El tipo '{document_type}' posiblemente fue visto en los últimos {self.recency_window} pasos.")
-        else:
-            print(f"[Bloom] El tipo '{document_type}' no estaba reciente. Marcando bits {pos1} y {pos2}.")
-        
-        # Marcamos los bits a 1 (Inserción) y guardamos recencia
-        for pos in positions:
-            self.bloom_array[pos] = 1
-        self.bloom_last_seen[signature] = step
+        if self.log.isEnabledFor(logging.DEBUG):
+            if seen and recent:
+                self.log.debug("[Bloom] El tipo '%s' posiblemente fue visto en los últimos %d pasos.",
+                               document_type, self.recency_window)
+            else:
+                self.log.debug("[Bloom] El tipo '%s' no estaba reciente. Marcando bits %s.",
+                               document_type, self.bloom.posiciones(signature))
+
+        # Marcamos los bits a 1 (Inserción) y la recencia en la generación actual
+        self.bloom.agregar(signature)
+        self.bloom_reciente.agregar(signature, step)
 
     # ==============================================================================
     # 2. LÓGICA SAMPLING (Basado ESTRICTAMENTE en tu Algoritmo 3)
@@ -103,57 +961,136 @@ class SistemaProcesamiento:
         Decide si guardamos a este usuario basándonos en su Hash y el Umbral.
         Define una ruta preferente simple para la recuperación.
         """
-        # Fórmula teórica: h(user) = (a * user + c) mod buckets
-        h_user = (self.hash_a * user_id + self.hash_c) % self.sample_buckets
+        if self.reservorio is not None:
+            return self._procesar_reservorio(user_id, data)
+
+        # Fórmula teórica: h(user) = ((a * user + c) mod p) mod buckets
+        h_user = self.hash_usuario(user_id)
         
-        print(f"[Sampling] Usuario {user_id} (Hash: {h_user}) | Umbral actual: {self.threshold}")
+        self.log.debug("[Sampling] Usuario %s (Hash: %d) | Umbral actual: %d", user_id, h_user, self.threshold)
 
         # Condición del algoritmo: if h(user) <= threshold (ajustado a <= para incluir el borde)
         if h_user <= self.threshold:
-            # Agregar a la muestra
-            if user_id not in self.sample:
-                self.sample[user_id] = []
-            self.sample[user_id].append(data)
+            # Agregar a la muestra; deque acotado: un usuario muy activo
+            # conserva solo sus últimos eventos
+            eventos = self.sample.get(user_id)
+            if eventos is None:
+                eventos = self.sample[user_id] = deque(maxlen=self.max_eventos_usuario)
+                usuarios = self.sample_por_bucket.get(h_user)
+                if usuarios is None:
+                    usuarios = self.sample_por_bucket[h_user] = set()
+                    heapq.heappush(self._buckets_ocupados, -h_user)
+                usuarios.add(user_id)
+            eventos.append(data)
             self.routing_choice[user_id] = "ruta_prioritaria"
-            print("   -> Usuario aceptado en la muestra. Ruta: prioritaria.")
+            self.log.debug("   -> Usuario aceptado en la muestra. Ruta: prioritaria.")
         else:
             self.routing_choice[user_id] = "ruta_normal"
-            print(f"   -> Usuario descartado.")
+            self.log.debug("   -> Usuario descartado.")
 
         # Manejo de desbordamiento (Overflow)
         # Teoría: while (users in sample > sample_size)
         while len(self.sample) > self.sample_size_limit:
-            print(f"   [!] Muestra llena. Reduciendo umbral de {self.threshold} a {self.threshold - 1}")
-            
-            # 1. Eliminar elementos con h(user) == threshold
-            usuarios_a_eliminar = []
-            for uid in self.sample:
-                h_uid = (self.hash_a * uid + self.hash_c) % self.sample_buckets
-                if h_uid == self.threshold:
-                    usuarios_a_eliminar.append(uid)
-            
-            for uid in usuarios_a_eliminar:
+            # 1. Eliminar los usuarios del bucket más alto; los buckets vacíos
+            # entre el umbral y ese bucket se saltan de una vez
+            bucket = -heapq.heappop(self._buckets_ocupados)
+            self.log.debug("   [!] Muestra llena. Reduciendo umbral de %d a %d", self.threshold, bucket - 1)
+            for uid in self.sample_por_bucket.pop(bucket):
                 del self.sample[uid]
-                print(f"   [!] Usuario {uid} eliminado por cambio de umbral.")
+                self.log.debug("   [!] Usuario %s eliminado por cambio de umbral.", uid)
 
             # 2. Reducir el umbral
-            self.threshold -= 1
+            self.threshold = bucket - 1
+
+    def _procesar_reservorio(self, user_id, data):
+        aceptado = self.reservorio.agregar((user_id, data))
+        # La ruta prioritaria queda para usuarios con un evento en la muestra
+        self.routing_choice[user_id] = "ruta_prioritaria" if aceptado else "ruta_normal"
+        self.log.debug("[Sampling] Evento %d de usuario %s %s en el reservorio (k=%d).",
+                       self.reservorio.vistos, user_id, "aceptado" if aceptado else "descartado",
+                       self.reservorio.k)
+
+    def muestra(self):
+        """Usuario -> eventos muestreados, en cualquiera de los dos modos."""
+        if self.reservorio is None:
+            return {uid: list(eventos) for uid, eventos in self.sample.items()}
+        agrupado = {}
+        for uid, evento in self.reservorio.elementos:
+            agrupado.setdefault(uid, []).append(evento)
+        return agrupado
 
     # ==============================================================================
     # 3. LÓGICA DISTINCT COUNTING (Exacto)
     # ==============================================================================
     def procesar_conteo_exacto(self, user_id, doc_type):
         """
-        Cuenta exactamente cuántos documentos ha visto un usuario y cuántos tipos distintos.
+        Cuenta exactamente cuántos documentos ha visto un usuario y cuántos
+        valores distintos (tipos, o la clave configurada). En modo
+        aproximado los distintos van a un HyperLogLog por usuario.
         """
-        if user_id not in self.user_distinct_docs:
-            self.user_distinct_docs[user_id] = set() # 'set' guarda solo elementos únicos
+        if self.conteo_distinto != "aproximado":
+            if user_id not in self.user_distinct_docs:
+                self.user_distinct_docs[user_id] = set() # 'set' guarda solo elementos únicos
+
+            self.user_distinct_docs[user_id].add(doc_type)
 
-        self.user_distinct_docs[user_id].add(doc_type)
+        if self.conteo_distinto != "exacto":
+            sketch = self.user_distinct_hll.get(user_id)
+            if sketch is None:
+                sketch = self.user_distinct_hll[user_id] = HyperLogLog(self.hll_precision)
+            sketch.agregar(doc_type)
 
         # Conteo exacto de documentos (no solo tipos)
         self.user_doc_count[user_id] = self.user_doc_count.get(user_id, 0) + 1
 
+    def distintos_usuario(self, user_id):
+        """Valores distintos vistos por el usuario (estimados si hay sketch)."""
+        sketch = self.user_distinct_hll.get(user_id)
+        if sketch is not None:
+            return sketch.estimar()
+        return len(self.user_distinct_docs.get(user_id, ()))
+
+    def distintos_total(self):
+        """Valores distintos entre todos los usuarios (fusión de sketches)."""
+        if self.conteo_distinto == "exacto":
+            return len(set().union(*self.user_distinct_docs.values()))
+        total = HyperLogLog(self.hll_precision)
+        for sketch in self.user_distinct_hll.values():
+            total.fusionar(sketch)
+        return total.estimar()
+
+    def fusionar_conteo(self, otro):
+        """
+        Une el conteo de distintos de otra partición (shard) del stream.
+        Ambos sistemas deben usar el mismo modo y la misma precisión.
+        """
+        if otro.conteo_distinto != self.conteo_distinto:
+            raise ValueError("los sistemas usan modos de conteo distintos")
+        if self._sucios is not None:
+            self._sucios.update(otro.user_doc_count)
+        for user_id, valores in otro.user_distinct_docs.items():
+            self.user_distinct_docs.setdefault(user_id, set()).update(valores)
+        for user_id, sketch in otro.user_distinct_hll.items():
+            propio = self.user_distinct_hll.get(user_id)
+            if propio is None:
+                propio = self.user_distinct_hll[user_id] = HyperLogLog(self.hll_precision)
+            propio.fusionar(sketch)
+        for user_id, cuenta in otro.user_doc_count.items():
+            self.user_doc_count[user_id] = self.user_doc_count.get(user_id, 0) + cuenta
+
+    def error_conteo_distinto(self):
+        """
+        Solo en modo "ambos": error relativo medio y máximo del HyperLogLog
+        frente a los sets exactos, por usuario.
+        """
+        if self.conteo_distinto != "ambos":
+            raise ValueError("la validación requiere conteo_distinto='ambos'")
+        errores = [abs(self.user_distinct_hll[u].estimar() - len(valores)) / len(valores)
+                   for u, valores in self.user_distinct_docs.items()]
+        if not errores:
+            return {"medio": 0.0, "maximo": 0.0}
+        return {"medio": sum(errores) / len(errores), "maximo": max(errores)}
+
     # ==============================================================================
     # 4. FREQUENCY MOMENTS (F1)
     # ==============================================================================
@@ -162,118 +1099,378 @@ class SistemaProcesamiento:
         F1 es simplemente la suma de las frecuencias de los elementos.
         """
         self.F1_total += search_freq
-        print(f"[Momentos] F1 (Suma Total Frecuencias): {self.F1_total}")
+        self.log.debug("[Momentos] F1 (Suma Total Frecuencias): %d", self.F1_total)
+
+    def procesar_momento_dos(self, doc_type, search_freq):
+        """
+        Actualiza el estimador AMS de F2 sobre los tipos y los heavy hitters
+        de tipos y de buckets de frecuencia (mismo bucket que la firma Bloom).
+        """
+        self.ams_tipos.agregar(doc_type)
+        self.hh_tipos.agregar(doc_type)
+        self.hh_frecuencias.agregar(str(search_freq // 10))
+
+    def momento_dos(self):
+        """F2 estimado sobre los tipos de documento (número sorpresa)."""
+        return self.ams_tipos.estimar()
+
+    def fusionar_momentos(self, otro):
+        """Une F1, F2 y heavy hitters de otra partición del stream."""
+        self.F1_total += otro.F1_total
+        self.ams_tipos.fusionar(otro.ams_tipos)
+        self.hh_tipos.fusionar(otro.hh_tipos)
+        self.hh_frecuencias.fusionar(otro.hh_frecuencias)
 
     # ==============================================================================
     # 5. LÓGICA DGIM (Simplificado)
     # ==============================================================================
-    def procesar_dgim(self, bit):
+    def procesar_dgim(self, bit, doc_type=None):
         """
-        Recibe un bit (1 o 0). Si es 1, crea un bucket y fusiona si es necesario.
+        Recibe un bit (1 o 0). Si es 1, crea un bucket de tamaño 1 y fusiona
+        los dos más viejos de cada tamaño que supere r buckets. Con doc_type
+        el bit también cuenta en el stream de ese tipo.
         """
-        self.current_timestamp += 1
-        
-        # Paso A: Eliminar buckets viejos (fuera de la ventana)
-        # Si el tiempo actual es 100 y ventana es 20, borramos todo lo anterior a 80
-        while len(self.dgim_buckets) > 0:
-            ultimo_bucket = self.dgim_buckets[-1]  # El más viejo está al final
-            if ultimo_bucket[1] <= self.current_timestamp - self.window_size:
-                self.dgim_buckets.pop()  # Borrar
+        self.dgim.agregar(bit)
+        if bit and doc_type is not None:
+            stream = self.tipo_stream.get(doc_type)
+            if stream is None:
+                stream = self.tipo_stream[doc_type] = self.dgim_tipos.nuevo_stream()
+            self.dgim_tipos.agregar(stream)
+        else:
+            self.dgim_tipos.avanzar()
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug("[DGIM] Estado Buckets (Tamaño, TiempoFinal): %s", self.dgim.buckets())
+
+    def actividad_reciente(self, k=None):
+        """Eventos estimados en los últimos k pasos (por defecto, la ventana)."""
+        return self.dgim.estimate(k)
+
+    def actividad_por_tipo(self, k=None):
+        return {tipo: self.dgim_tipos.estimate(stream, k) for tipo, stream in self.tipo_stream.items()}
+
+    # ==============================================================================
+    # PROCESAMIENTO POR LOTES
+    # ==============================================================================
+    def procesar_evento(self, evento):
+        """Corre los cinco algoritmos sobre un evento (dict con el formato de w3)."""
+        self.paso += 1
+        doc_type = evento["documentType"]
+        freq = evento["searchFrequency"]
+        user_id = evento.get("simulatedUserID", 0)
+        if self._sucios is not None:
+            self._sucios.add(user_id)
+        self.procesar_bloom(doc_type, step=self.paso, search_freq=freq)
+        self.procesar_muestreo(user_id, evento)
+        self.procesar_conteo_exacto(user_id, evento.get(self.clave_distinta, doc_type))
+        self.procesar_momento_uno(freq)
+        self.procesar_momento_dos(doc_type, freq)
+        # Cada llegada es un 1 en el stream de bits de DGIM (y en el de su tipo)
+        self.procesar_dgim(1, doc_type)
+
+    def process_batch(self, events):
+        """
+        Procesa un lote (cualquier iterable de eventos) y retorna cuántos
+        eventos consumió. Sin trazas habilitadas no se escribe nada por evento.
+        """
+        procesar = self.procesar_evento
+        checkpointer = self.checkpointer
+        procesados = 0
+        for evento in events:
+            procesar(evento)
+            procesados += 1
+            if checkpointer is not None and self.paso >= checkpointer.proximo:
+                checkpointer.guardar()
+        self.log.info("[Lote] %d eventos procesados (total %d, F1 %d)", procesados, self.paso, self.F1_total)
+        return procesados
+
+    async def process_async(self, events):
+        """Como process_batch, consumiendo un iterable asíncrono (eventos_async)."""
+        procesar = self.procesar_evento
+        checkpointer = self.checkpointer
+        procesados = 0
+        async for evento in events:
+            procesar(evento)
+            procesados += 1
+            if checkpointer is not None and self.paso >= checkpointer.proximo:
+                checkpointer.guardar()
+        self.log.info("[Lote] %d eventos procesados (total %d, F1 %d)", procesados, self.paso, self.F1_total)
+        return procesados
+
+    # ==============================================================================
+    # CHECKPOINT / RESTORE
+    # ==============================================================================
+    def activar_checkpoints(self, directorio, cada=50_000, completo_cada=8, en_segundo_plano=True):
+        """Guarda snapshots periódicos desde process_batch; retorna el Checkpointer."""
+        self._sucios = set()
+        self.checkpointer = Checkpointer(self, directorio, cada, completo_cada, en_segundo_plano)
+        return self.checkpointer
+
+    def _secciones_crudas(self):
+        """Arreglos grandes de bytes: en los deltas van como páginas cambiadas."""
+        secciones = {"bloom": self.bloom.bits}
+        for i, filtro in enumerate(self.bloom_reciente.filtros):
+            secciones[f"reciente.{i}"] = filtro.bits
+        secciones["hh_tipos"] = memoryview(self.hh_tipos.cms.tabla).cast("B")
+        secciones["hh_frecuencias"] = memoryview(self.hh_frecuencias.cms.tabla).cast("B")
+        return secciones
+
+    def _estado_chico(self):
+        return {
+            "config": self._config,
+            "paso": self.paso,
+            "F1_total": self.F1_total,
+            "bloom_insertados": self.bloom.insertados,
+            "reciente": (self.bloom_reciente.generacion_actual,
+                         [filtro.insertados for filtro in self.bloom_reciente.filtros]),
+            # rng, hash y reservorio van juntos para conservar el rng compartido
+            "muestreo": (self.rng, self.hash_usuario, self.reservorio, self.threshold, self.sample,
+                         self.sample_por_bucket, self._buckets_ocupados),
+            "dgim": (self.dgim, self.dgim_tipos, self.tipo_stream),
+            "momentos": (self.ams_tipos, self.hh_tipos.candidatos, self.hh_tipos.cms.total,
+                         self.hh_frecuencias.candidatos, self.hh_frecuencias.cms.total),
+        }
+
+    def _estado_usuarios(self, usuarios=None):
+        """
+        Conteos, distintos y ruta por usuario. Completo: los cuatro dicts tal
+        cual (pickle los recorre en C). Delta: solo los usuarios tocados.
+        """
+        if usuarios is None:
+            return (self.user_doc_count, self.user_distinct_docs, self.user_distinct_hll, self.routing_choice)
+        return {uid: (self.user_doc_count.get(uid), self.user_distinct_docs.get(uid),
+                      self.user_distinct_hll.get(uid), self.routing_choice.get(uid))
+                for uid in usuarios}
+
+    def _aplicar_snapshot(self, secciones):
+        for nombre, arreglo in self._secciones_crudas().items():
+            modo, contenido = secciones[nombre]
+            if modo == SECCION_PAGINAS:
+                _aplicar_paginas(arreglo, contenido)
             else:
+                arreglo[:] = contenido
+        estado = pickle.loads(zlib.decompress(secciones["estado"][1]))
+        self.paso = estado["paso"]
+        self.F1_total = estado["F1_total"]
+        self.bloom.insertados = estado["bloom_insertados"]
+        self.bloom_reciente.generacion_actual, insertados = estado["reciente"]
+        for filtro, n in zip(self.bloom_reciente.filtros, insertados):
+            filtro.insertados = n
+        (self.rng, self.hash_usuario, self.reservorio, self.threshold, self.sample,
+         self.sample_por_bucket, self._buckets_ocupados) = estado["muestreo"]
+        self.hash_a, self.hash_c = self.hash_usuario.a, self.hash_usuario.b
+        self.dgim, self.dgim_tipos, self.tipo_stream = estado["dgim"]
+        (self.ams_tipos, self.hh_tipos.candidatos, self.hh_tipos.cms.total,
+         self.hh_frecuencias.candidatos, self.hh_frecuencias.cms.total) = estado["momentos"]
+        self.hh_tipos._reconstruir()
+        self.hh_frecuencias._reconstruir()
+        usuarios = pickle.loads(zlib.decompress(secciones["usuarios"][1]))
+        if isinstance(usuarios, tuple):
+            self.user_doc_count, self.user_distinct_docs, self.user_distinct_hll, self.routing_choice = usuarios
+            return
+        destinos = (self.user_doc_count, self.user_distinct_docs, self.user_distinct_hll, self.routing_choice)
+        for uid, valores in usuarios.items():
+            for destino, valor in zip(destinos, valores):
+                if valor is not None:
+                    destino[uid] = valor
+
+    @classmethod
+    def restaurar(cls, directorio, logger=None):
+        """
+        Reconstruye el sistema desde el último snapshot completo del
+        directorio más sus deltas en orden. Un delta corrupto o faltante
+        corta la cadena: se restaura hasta el último checkpoint válido.
+        """
+        archivos = _archivos_snapshot(directorio)
+        completos = [(base, ruta) for base, ruta in archivos if ruta.endswith(".snap")]
+        if not completos:
+            raise FileNotFoundError(f"no hay snapshots en {directorio}")
+        base, ruta = max(completos)
+        _, _, _, secciones = _leer_snapshot(ruta)
+        config = pickle.loads(zlib.decompress(secciones["estado"][1]))["config"]
+        sistema = cls(logger=logger, **config)
+        sistema._aplicar_snapshot(secciones)
+        deltas = sorted(ruta for b, ruta in archivos if b == base and ruta.endswith(".delta"))
+        for esperado, ruta in enumerate(deltas, 1):
+            try:
+                _, _, secuencia, secciones = _leer_snapshot(ruta)
+            except ValueError as exc:
+                sistema.log.warning("[Checkpoint] %s", exc)
+                break
+            if secuencia != esperado:
                 break
+            sistema._aplicar_snapshot(secciones)
+        return sistema
 
-        # Paso B: Si el bit es 0, no hacemos nada (según DGIM básico para contar 1s)
-        if bit == 0:
-            return
 
-        # Paso C: Si bit es 1, crear nuevo bucket de tamaño 1
-        # Insertamos al inicio (índice 0 es lo más reciente)
-        new_bucket = [1, self.current_timestamp] 
-        self.dgim_buckets.insert(0, new_bucket)
-
-        # Paso D: Fusión (Merge) - La parte clave de la teoría
-        # "Si hay 3 buckets del mismo tamaño, fusionar los 2 más viejos"
-        idx = 0
-        while idx < len(self.dgim_buckets) - 2:
-            # Revisamos 3 buckets consecutivos: actual, siguiente, subsiguiente
-            b1 = self.dgim_buckets[idx]
-            b2 = self.dgim_buckets[idx+1]
-            b3 = self.dgim_buckets[idx+2]
-
-            if b1[0] == b2[0] and b2[0] == b3[0]:
-                # ¡Tenemos tres del mismo tamaño!
-                # Fusionamos b2 y b3 (los más viejos de ese tamaño)
-                # Nuevo tamaño = b2.size + b3.size (ej. 1+1=2, 2+2=4)
-                # Nos quedamos con el timestamp del más reciente de los dos fusionados (b2)
-                merged_bucket = [b2[0] + b3[0], b2[1]]
-                
-                # Eliminamos b2 y b3, insertamos el fusionado
-                self.dgim_buckets.pop(idx+1)
-                self.dgim_buckets.pop(idx+1)
-                self.dgim_buckets.insert(idx+1, merged_bucket)
-                
-                # Seguimos revisando desde la misma posición por si generó cascada
-            else:
-                idx += 1
-        
-        print(f"[DGIM] Estado Buckets (Tamaño, TiempoFinal): {self.dgim_buckets}")
+# ==============================================================================
+# FUENTE: LECTURA INCREMENTAL DE document_data_v2.json (w3)
+# ==============================================================================
+def leer_documentos(ruta, tam_bloque=1 << 20):
+    """
+    Registros de un arreglo JSON (el document_data_v2.json de w3) o de un
+    archivo JSONL, uno a la vez y en memoria constante. Usa el lector
+    compartido comun/lectura_json.py (bloques de tam_bloque caracteres +
+    raw_decode), el mismo de la carga masiva de w1.
+    """
+    return iter_json_records(ruta, tam_bloque)
+
+
+def usuario_de_documento(documento, num_usuarios=15):
+    """
+    Los documentos de w3 no traen usuario: se usa simulatedUserID si existe
+    y si no un id estable en 1..num_usuarios derivado del hash de _id
+    (el mismo documento cae siempre en el mismo usuario al repetir el log).
+    """
+    usuario = documento.get("simulatedUserID")
+    if usuario is not None:
+        return usuario
+    return _hashes_dobles(str(documento.get("_id", "")))[0] % num_usuarios + 1
+
+
+def eventos_desde_archivo(ruta, num_usuarios=15, tam_bloque=1 << 20, desde=0):
+    """
+    Eventos listos para procesar_evento / process_batch, de forma perezosa.
+    `desde` salta los primeros registros (retomar tras restaurar).
+    """
+    for documento in islice(leer_documentos(ruta, tam_bloque), desde, None):
+        # Solo los campos que usa el stream: la muestra guarda eventos
+        yield {
+            "_id": documento.get("_id"),
+            "documentType": documento["documentType"],
+            "searchFrequency": documento["searchFrequency"],
+            "simulatedUserID": usuario_de_documento(documento, num_usuarios),
+        }
+
+
+async def eventos_async(ruta, num_usuarios=15, tam_cola=4096, tam_lote=512, tam_bloque=1 << 20, desde=0):
+    """
+    Variante asyncio: un productor lee y decodifica lotes en un executor y
+    los deja en una asyncio.Queue acotada. Si el consumidor se atrasa, la
+    cola se llena y el productor espera (backpressure): a lo sumo
+    tam_cola + tam_lote eventos en memoria.
+    """
+    loop = asyncio.get_running_loop()
+    cola = asyncio.Queue(maxsize=tam_cola)
+    fin = object()
+    eventos = eventos_desde_archivo(ruta, num_usuarios, tam_bloque, desde)
+
+    async def producir():
+        try:
+            while True:
+                lote = await loop.run_in_executor(None, lambda: list(islice(eventos, tam_lote)))
+                if not lote:
+                    break
+                for evento in lote:
+                    await cola.put(evento)
+            await cola.put(fin)
+        except Exception as exc:  # se re-lanza del lado del consumidor
+            await cola.put(exc)
+
+    productor = loop.create_task(producir())
+    try:
+        while True:
+            evento = await cola.get()
+            if evento is fin:
+                break
+            if isinstance(evento, Exception):
+                raise evento
+            yield evento
+    finally:
+        productor.cancel()
+
 
 # ==============================================================================
 # SIMULACIÓN DEL FLUJO (STREAM)
 # ==============================================================================
+def simular(num_eventos=10):
+    # 1. Crear el sistema
+    # "ambos": sets exactos + HyperLogLog, para comparar en el resumen
+    sistema = SistemaProcesamiento(conteo_distinto="ambos")
+
+    # 2. Generar datos aleatorios (Como pide el ejercicio)
+    tipos_docs = ["report", "memo", "presentation", "email"]
+
+    print("--- INICIANDO STREAM DE DATOS ---\n")
+
+    for i in range(num_eventos):
+        print("\n" + SUB)
+        print(f"T (Tiempo): {i+1}")
+        print(SUB)
+
+        # Como el JSON no trae usuario, simulamos uno al azar (ID entre 1 y 15)
+        # Esto es necesario para el Sampling y el Distinct Counting
+        dato_json = {
+            "documentType": random.choice(tipos_docs),
+            "searchFrequency": random.randint(1, 100),
+            "simulatedUserID": random.randint(1, 15),
+        }
+
+        print(f"Llegó dato: {dato_json}")
+
+        # --- EJECUTAR LOS 5 ALGORITMOS ---
+        # Bloom -> Sampling -> Conteo exacto -> F1 -> DGIM (bit=1 por llegada)
+        sistema.procesar_evento(dato_json)
+
+    print("\n--- FIN DE LA SIMULACIÓN ---")
+    imprimir_resumen(sistema)
+    return sistema
+
+
+def imprimir_resumen(sistema, detalle=True):
+    """Con detalle=False (replays grandes) no se listan los usuarios uno a uno."""
+    print(LINE)
+    print("RESUMEN FINAL")
+    print(LINE)
+    print(f"Eventos: {sistema.paso} | F1: {sistema.F1_total}")
+    print(f"Muestra (usuarios): {list(sistema.muestra())}")
+    if detalle:
+        print(f"Conteo exacto de documentos por usuario: {sistema.user_doc_count}")
+    else:
+        print(f"Usuarios distintos: {len(sistema.user_doc_count)}")
+    print(f"Distintos por {sistema.clave_distinta} (HyperLogLog ~{1.04 / math.sqrt(1 << sistema.hll_precision):.1%}): "
+          f"total ~{sistema.distintos_total()} | error vs exacto: {sistema.error_conteo_distinto()['maximo']:.1%} máx.")
+    print(f"Heavy hitters por tipo: {sistema.hh_tipos.top()} | por bucket de frecuencia: {sistema.hh_frecuencias.top()}")
+    print(f"F2 estimado (AMS) sobre tipos: {sistema.momento_dos()}")
+    if detalle:
+        print(f"Rutas asignadas por muestreo: {sistema.routing_choice}")
+    print(f"DGIM: ~{sistema.actividad_reciente()} eventos en la ventana de {sistema.window_size} "
+          f"(error <= {sistema.dgim.cota_error():.0%}) | por tipo: {sistema.actividad_por_tipo()}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Procesamiento de streams de la unidad 2")
+    parser.add_argument("--archivo", help="JSON (arreglo) o JSONL de documentos, p. ej. w3/document_data_v2.json")
+    parser.add_argument("--usuarios", type=int, default=15, help="usuarios simulados a partir de _id")
+    parser.add_argument("--async", dest="asincrono", action="store_true", help="lector asyncio con backpressure")
+    parser.add_argument("--checkpoints", help="directorio de snapshots (restaura si ya hay uno)")
+    args = parser.parse_args(argv)
+
+    if not args.archivo:
+        # La demo muestra las trazas por evento
+        logging.basicConfig(level=logging.DEBUG, format="%(message)s", stream=sys.stdout)
+        simular()
+        return
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+    hay_snapshot = (args.checkpoints and os.path.isdir(args.checkpoints)
+                    and any(ruta.endswith(".snap") for _, ruta in _archivos_snapshot(args.checkpoints)))
+    if hay_snapshot:
+        # Se retoma el replay donde quedó el último checkpoint
+        sistema = SistemaProcesamiento.restaurar(args.checkpoints)
+    else:
+        sistema = SistemaProcesamiento(conteo_distinto="ambos", clave_distinta="_id")
+    if args.checkpoints:
+        checkpointer = sistema.activar_checkpoints(args.checkpoints)
+    if args.asincrono:
+        asyncio.run(sistema.process_async(eventos_async(args.archivo, args.usuarios, desde=sistema.paso)))
+    else:
+        sistema.process_batch(eventos_desde_archivo(args.archivo, args.usuarios, desde=sistema.paso))
+    if args.checkpoints:
+        checkpointer.guardar()
+        checkpointer.esperar()
+    imprimir_resumen(sistema, detalle=False)
+
 
-# 1. Crear el sistema
-sistema = SistemaProcesamiento()
-
-# 2. Generar datos aleatorios (Como pide el ejercicio)
-tipos_docs = ["report", "memo", "presentation", "email"]
-
-print("--- INICIANDO STREAM DE DATOS ---\n")
-
-for i in range(10): # Simularemos 10 llegadas de datos
-    print("\n" + SUB)
-    print(f"T (Tiempo): {i+1}")
-    print(SUB)
-    
-    # Generar JSON simulado
-    doc_type = random.choice(tipos_docs)
-    freq = random.randint(1, 100)
-    
-    # Como el JSON no trae usuario, simulamos uno al azar (ID entre 1 y 15)
-    # Esto es necesario para el Sampling y el Distinct Counting
-    user_id = random.randint(1, 15)
-    
-    dato_json = {
-        "documentType": doc_type,
-        "searchFrequency": freq,
-        "simulatedUserID": user_id
-    }
-    
-    print(f"Llegó dato: {dato_json}")
-
-    # --- EJECUTAR LOS 5 ALGORITMOS ---
-    
-    # 1. Bloom Filter
-    sistema.procesar_bloom(doc_type, step=i+1, search_freq=freq)
-    
-    # 2. Behavior Sampling
-    sistema.procesar_muestreo(user_id, dato_json)
-    
-    # 3. Distinct Counting (Exacto)
-    sistema.procesar_conteo_exacto(user_id, doc_type)
-    
-    # 4. Moment 1
-    sistema.procesar_momento_uno(freq)
-    
-    # 5. DGIM
-    # Para DGIM contamos cada búsqueda en la ventana (bit=1 en cada llegada).
-    print(f"[DGIM] Entrada al stream de bits: 1")
-    sistema.procesar_dgim(1)
-
-print("\n--- FIN DE LA SIMULACIÓN ---")
-print(LINE)
-print("RESUMEN FINAL")
-print(LINE)
-print(f"Muestra (usuarios): {list(sistema.sample.keys())}")
-print(f"Conteo exacto de documentos por usuario: {sistema.user_doc_count}")
-print(f"Rutas asignadas por muestreo: {sistema.routing_choice}")
+if __name__ == "__main__":
+    # Importando el módulo no se imprime nada
+    main()